@@ -1,17 +1,107 @@
+import linecache
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
-from sympy import latex, sin, exp, Symbol
+import mpmath
+from numba import float64, get_num_threads, int64, njit, prange, typeof
+from sympy import latex, lambdify, sin, exp, Symbol
+
+
+LEFT_RECTANGLE, RIGHT_RECTANGLE, MIDDLE_RECTANGLE, TRAPEZE, SIMPSON = range(5)
+# при погрешности меньше этого значения интеграл вычисляется адаптивной квадратурой mpmath
+ADAPTIVE_EPSILON = 1e-6
+
+
+@njit(parallel=True)
+def _grid_sum(func, start: float, step: float, count: int) -> float:
+    """
+    Сумма значений функции в count узлах start, start + step, ..., start + step * (count - 1)
+    """
+    result = 0.0
+    for i in prange(count):
+        result += func(start + step * i)
+    return result
+
+
+@njit
+def _estimate(method: int, h: float, edge_sum: float, values_sum: float, odd_sum: float) -> float:
+    """
+    Значение интеграла по накопленным суммам значений функции в узлах сетки с шагом h
+    """
+    if method == SIMPSON:
+        return h / 3 * (edge_sum + 4 * odd_sum + 2 * values_sum)
+    return h * (edge_sum + values_sum)
+
+
+@njit
+def _integrate(func, a: float, b: float, n: int, method: int, runge_denom: float, epsilon: float) -> tuple[float, int]:
+    """
+    Вычисление интеграла методом method с удвоением числа разбиения до выполнения правила Рунге.
+    При удвоении n новыми узлами оказываются только середины отрезков старой сетки,
+    поэтому для всех методов, кроме средних прямоугольников, суммы по старым узлам переиспользуются
+    """
+    h = (b - a) / n
+    edge_sum = 0.0
+    odd_sum = 0.0
+    if method == LEFT_RECTANGLE:
+        values_sum = _grid_sum(func, a, h, n)
+    elif method == RIGHT_RECTANGLE:
+        values_sum = _grid_sum(func, a + h, h, n)
+    elif method == MIDDLE_RECTANGLE:
+        values_sum = _grid_sum(func, a + h / 2, h, n)
+    elif method == TRAPEZE:
+        edge_sum = (func(a) + func(b)) / 2
+        values_sum = _grid_sum(func, a + h, h, n - 1)
+    else:
+        # для метода Симпсона values_sum - сумма по четным внутренним узлам, odd_sum - по нечетным
+        edge_sum = func(a) + func(b)
+        odd_sum = _grid_sum(func, a + h, 2 * h, n // 2)
+        values_sum = _grid_sum(func, a + 2 * h, 2 * h, (n - 1) // 2)
+    integral_value_first = _estimate(method, h, edge_sum, values_sum, odd_sum)
+    while True:
+        integral_value_zero = integral_value_first
+        if method == MIDDLE_RECTANGLE:
+            values_sum = _grid_sum(func, a + h / 4, h / 2, 2 * n)
+        elif method == SIMPSON:
+            # после удвоения все старые внутренние узлы становятся четными, а новые - нечетными
+            values_sum += odd_sum
+            odd_sum = _grid_sum(func, a + h / 2, h, n)
+        else:
+            values_sum += _grid_sum(func, a + h / 2, h, n)
+        n *= 2
+        h *= 0.5
+        integral_value_first = _estimate(method, h, edge_sum, values_sum, odd_sum)
+        if abs(integral_value_first - integral_value_zero) / runge_denom < epsilon:
+            break
+    return integral_value_first, n
 
 
 class Equation:
     """
     Класс обертка для уравнений
     """
-    def __init__(self, equation_func, symbol: Symbol) -> None:
+    def __init__(self, equation_func) -> None:
+        symbols = tuple(equation_func.free_symbols)
+        assert len(symbols) == 1, "Функция должна зависеть ровно от одной переменной"
         self.equation_func = equation_func
-        self.symbol = symbol
-
-    def get_string(self) -> str:
+        self.func = lambdify(symbols, equation_func, modules="numpy", cse=True)
+        self.mp_func = lambdify(symbols, equation_func, modules="mpmath", cse=True)
+        # lambdify регистрирует исходный код каждой сгенерированной функции в linecache
+        linecache.clearcache()
+        self.jit_func = njit(self.func)
+
+    def compile(self) -> None:
+        """
+        Компиляция функции и ядра интегрирования для нее заранее, до первого вычисления
+        """
+        self.jit_func.compile((float64,))
+        _integrate.compile(
+            (typeof(self.jit_func), float64, float64, int64, int64, float64, float64)
+        )
+
+    @cached_property
+    def latex_str(self) -> str:
         return latex(self.equation_func)
 
 
@@ -19,47 +109,56 @@ class SolutionMethod(ABC):
     """
     Базовый абстрактный класс для классов реализаций методов вычисления интегралов
     """
+    @property
+    @abstractmethod
+    def method(self) -> int:
+        """
+        Номер метода для ядра _integrate
+        """
+        pass
+
     def __init__(self, equation: Equation, a: float, b: float, n: int, k: int, epsilon: float) -> None:
         assert a != b, "Значения a и b должны быть различны"
         assert a < b, "Значение a должно быть меньше b"
         assert epsilon > 0, "Значение эпсилон должно быть больше нуля"
         self._equation = equation
-        self._a = a
-        self._b = b
+        self._f = equation.jit_func
+        self._a = float(a)
+        self._b = float(b)
         self._n = n
         self._k = k
+        self._runge_denom = float((1 << k) - 1)
         self._epsilon = epsilon
+        # при малой погрешности вместо выбранного метода используется адаптивная квадратура mpmath
+        self.adaptive = epsilon < ADAPTIVE_EPSILON
         self._h = (b - a) / n
 
-    @abstractmethod
+    def _calc_adaptive(self) -> tuple[float, int]:
+        """
+        Вычисление интеграла адаптивной квадратурой mpmath.quad.
+        Вместо числа разбиения возвращается число вычислений функции
+        """
+        evaluations_count = 0
+
+        def func(x):
+            nonlocal evaluations_count
+            evaluations_count += 1
+            return self._equation.mp_func(x)
+
+        return float(mpmath.quad(func, [self._a, self._b])), evaluations_count
+
     def calc(self) -> tuple[float, int]:
-        pass
+        if self.adaptive:
+            return self._calc_adaptive()
+        return _integrate(
+            self._f, self._a, self._b, self._n, self.method, self._runge_denom, self._epsilon
+        )
 
 
 class RectangleMethod(SolutionMethod):
     """
     Базовый класс для реализации метода прямоугольников
     """
-    def __init__(self, equation: Equation, a: float, b: float, n: int, k: int, epsilon: float) -> None:
-        super().__init__(equation, a, b, n, k, epsilon)
-
-    def calc(self) -> tuple[float, int]:
-        func = self._equation.equation_func
-        x = self._equation.symbol
-        integral_value_first: float = 0.0
-        n: int = self._n
-        while True:
-            integral_value_zero = integral_value_first
-            integral_value_first = 0.0
-            h = (self._b - self._a) / n
-            for i in range(n):
-                x_i = self._a + h * i
-                integral_value_first += func.subs(x, x_i).evalf()
-            integral_value_first *= h
-            if abs((integral_value_first - integral_value_zero) / (2 ** self._k - 1)) < self._epsilon:
-                break
-            n *= 2
-        return integral_value_first, n
 
 
 class RectangleLeftMethod(RectangleMethod):
@@ -67,6 +166,7 @@ class RectangleLeftMethod(RectangleMethod):
     Класс метода левых прямоугольников
     """
     name: str = 'метод левых прямоугольников'
+    method: int = LEFT_RECTANGLE
 
     def __init__(self, equation: Equation, a: float, b: float, n: int, epsilon: float = 0.01) -> None:
         super().__init__(equation, a, b, n, 1, epsilon)
@@ -77,123 +177,51 @@ class RectangleRightMethod(RectangleMethod):
     Класс метода правых прямоугольников
     """
     name: str = 'метод правых прямоугольников'
+    method: int = RIGHT_RECTANGLE
 
     def __init__(self, equation: Equation, a: float, b: float, n: int, epsilon: float = 0.01) -> None:
         super().__init__(equation, a, b, n, 1, epsilon)
 
-    def calc(self) -> tuple[float, int]:
-        func = self._equation.equation_func
-        x = self._equation.symbol
-        integral_value_first: float = 0.0
-        n: int = self._n
-        while True:
-            integral_value_zero = integral_value_first
-            integral_value_first = 0.0
-            h = (self._b - self._a) / n
-            for i in range(n):
-                x_i = self._a + h + h * i
-                integral_value_first += func.subs(x, x_i).evalf()
-            integral_value_first *= h
-            if abs((integral_value_first - integral_value_zero) / (2 ** self._k - 1)) < self._epsilon:
-                break
-            n *= 2
-        return integral_value_first, n
-
 
 class RectangleMiddleMethod(RectangleMethod):
     """
     Класс метода средних прямоугольников
     """
     name: str = 'метод средних прямоугольников'
+    method: int = MIDDLE_RECTANGLE
 
     def __init__(self, equation: Equation, a: float, b: float, n: int, epsilon: float = 0.01) -> None:
         super().__init__(equation, a, b, n, 2, epsilon)
 
-    def calc(self) -> tuple[float, int]:
-        func = self._equation.equation_func
-        x = self._equation.symbol
-        integral_value_first: float = 0.0
-        n: int = self._n
-        while True:
-            integral_value_zero = integral_value_first
-            integral_value_first = 0.0
-            h = (self._b - self._a) / n
-            for i in range(n):
-                x_i = self._a + h / 2 + h * i
-                integral_value_first += func.subs(x, x_i).evalf()
-            integral_value_first *= h
-            if abs((integral_value_first - integral_value_zero) / (2 ** self._k - 1)) < self._epsilon:
-                break
-            n *= 2
-        return integral_value_first, n
-
 
 class TrapezeMethod(SolutionMethod):
     """
     Класс метода трапеций
     """
     name: str = 'метод трапеций'
+    method: int = TRAPEZE
 
     def __init__(self, equation: Equation, a: float, b: float, n: int, epsilon: float = 0.01) -> None:
         super().__init__(equation, a, b, n, 2, epsilon)
 
-    def calc(self) -> tuple[float, int]:
-        func = self._equation.equation_func
-        x = self._equation.symbol
-        integral_value_first: float = 0.0
-        n: int = self._n
-        while True:
-            integral_value_zero = integral_value_first
-            integral_value_first = 0.0
-            h = (self._b - self._a) / n
-            for i in range(1, n):
-                x_i = self._a + h * i
-                integral_value_first += func.subs(x, x_i).evalf()
-            integral_value_first += (func.subs(x, self._a).evalf() + func.subs(x, self._b).evalf()) / 2
-            integral_value_first *= h
-            if abs((integral_value_first - integral_value_zero) / (2 ** self._k - 1)) < self._epsilon:
-                break
-            n *= 2
-        return integral_value_first, n
-
 
 class SimpsonMethod(SolutionMethod):
     """
     Класс метода Симпсона
     """
     name: str = 'метод Симпсона'
+    method: int = SIMPSON
 
     def __init__(self, equation: Equation, a: float, b: float, n: int, epsilon: float = 0.01) -> None:
         super().__init__(equation, a, b, n, 4, epsilon)
 
-    def calc(self) -> tuple[float, int]:
-        func = self._equation.equation_func
-        x = self._equation.symbol
-        integral_value_first: float = 0.0
-        n: int = self._n
-        while True:
-            integral_value_zero = integral_value_first
-            integral_value_first = 0.0
-            h = (self._b - self._a) / n
-            for i in range(1, n):
-                x_i = self._a + h * i
-                if i % 2 == 0:
-                    integral_value_first += 2 * func.subs(x, x_i).evalf()
-                    continue
-                integral_value_first += 4 * func.subs(x, x_i).evalf()
-            integral_value_first += func.subs(x, self._a).evalf() + func.subs(x, self._b).evalf()
-            integral_value_first *= h / 3
-            if abs((integral_value_first - integral_value_zero) / (2 ** self._k - 1)) < self._epsilon:
-                break
-            n *= 2
-        return integral_value_first, n
-
 
 def input_data(equations, solution_methods) -> SolutionMethod:
     equation = None
+    equations_menu = "\n".join(f"{i + 1}. {equation_iter.latex_str}" for i, equation_iter in enumerate(equations))
     while True:
         print("Выберите функцию, интеграл которой требуется вычислить:")
-        [print(f"{i + 1}. {equation_iter.get_string()}") for i, equation_iter in enumerate(equations)]
+        print(equations_menu)
         equation_num = int(input("Введите номер выбранной функции...\n"))
         if equation_num < 1 or equation_num > len(equations):
             print("Номер функции не найден, повторите ввод")
@@ -211,9 +239,12 @@ def input_data(equations, solution_methods) -> SolutionMethod:
             continue
         break
     solution_method = None
+    solution_methods_menu = "\n".join(
+        f"{i + 1}. {solution_method_iter.name}" for i, solution_method_iter in enumerate(solution_methods)
+    )
     while True:
         print("Выберите метод решения")
-        [print(f"{i + 1}. {solution_method_iter.name}") for i, solution_method_iter in enumerate(solution_methods)]
+        print(solution_methods_menu)
         solution_num = int(input("Введите номер выбранного метода решения...\n"))
         if solution_num < 1 or solution_num > len(solution_methods):
             print("Номер метода не найден, повторите ввод")
@@ -249,11 +280,11 @@ def input_data(equations, solution_methods) -> SolutionMethod:
 def main():
     x = Symbol('x')
     equations = (
-        Equation(x ** 3 - 2 * x ** 2 - 5 * x + 24, x),
-        Equation(x ** 2, x),
-        Equation(sin(x * 2) + 2 * x ** 3 - 1.3 * x + 5.14, x),
-        Equation(exp(x) - 1.12 * x ** 2 - 3.14, x),
-        Equation(x ** 5 - 1.18, x)
+        Equation(x ** 3 - 2 * x ** 2 - 5 * x + 24),
+        Equation(x ** 2),
+        Equation(sin(x * 2) + 2 * x ** 3 - 1.3 * x + 5.14),
+        Equation(exp(x) - 1.12 * x ** 2 - 3.14),
+        Equation(x ** 5 - 1.18)
     )
     solution_methods = (
         RectangleLeftMethod,
@@ -262,11 +293,26 @@ def main():
         TrapezeMethod,
         SimpsonMethod,
     )
-    solution_method = input_data(equations, solution_methods)
+    # пока пользователь вводит данные, функции компилируются в фоне;
+    # компиляция Numba выполняется под общей блокировкой, поэтому достаточно одного потока.
+    # Пул потоков Numba запускается в главном потоке, иначе процесс зависает при завершении
+    get_num_threads()
+    executor = ThreadPoolExecutor(max_workers=1)
+    for equation in equations:
+        executor.submit(equation.compile)
+    try:
+        solution_method = input_data(equations, solution_methods)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     if solution_method is None:
         return
     integral_value, n = solution_method.calc()
     print(f"Вычисленное значение интеграла {integral_value}")
+    if solution_method.adaptive:
+        print(f"Погрешность меньше {ADAPTIVE_EPSILON}, поэтому вместо метода '{solution_method.name}' "
+              f"интеграл вычислен адаптивной квадратурой mpmath")
+        print(f"Число вычислений функции {n}")
+        return
     print(f"Число разбиения интервала интегрирования для достижения требуемой точности {n}")
 
 